@@ -1,31 +1,57 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, HTTPException, Query
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import AsyncMongoClient, InsertOne, WriteConcern
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional
 import uuid
 from datetime import datetime
+from dataclasses import dataclass
 import socketio
 import asyncio
+import contextlib
+import orjson
+import redis.asyncio as aioredis
+from redis.exceptions import WatchError
+from collections import OrderedDict, deque
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncMongoClient(mongo_url, maxPoolSize=50)
 db = client[os.environ['DB_NAME']]
 
+# Chat messages are ephemeral, so writes to them are not acknowledged
+messages_coll = db.get_collection("messages", write_concern=WriteConcern(w=0))
+
+class OrjsonJSON:
+    """json module replacement so Socket.IO packets are encoded with orjson"""
+    @staticmethod
+    def dumps(obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return orjson.loads(s)
+
+# Optional Redis for running several workers: Socket.IO fan-out and room
+# presence are shared through it when REDIS_URL is set
+redis_url = os.environ.get('REDIS_URL')
+redis_client = aioredis.from_url(redis_url, decode_responses=True) if redis_url else None
+
 # Socket.IO server
 sio = socketio.AsyncServer(
     async_mode='asgi',
+    client_manager=socketio.AsyncRedisManager(redis_url) if redis_url else None,
     cors_allowed_origins="*",
-    logger=True,
-    engineio_logger=True
+    json=OrjsonJSON,
+    logger=os.getenv('SIO_DEBUG') == '1',
+    engineio_logger=False
 )
 
 # Create the main app
@@ -37,92 +63,392 @@ socket_app = socketio.ASGIApp(sio, app)
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+def _uid():
+    return uuid.uuid4().hex
+
 # Data Models
 class Message(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    model_config = ConfigDict(frozen=True, strict=True, extra='ignore')
+
+    id: str = Field(default_factory=_uid)
     room_id: str
     username: str
     message: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 class Room(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    model_config = ConfigDict(frozen=True, strict=True, extra='ignore')
+
+    id: str = Field(default_factory=_uid)
     name: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     created_by: str
 
 class User(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=_uid)
     username: str
     room_id: Optional[str] = None
     socket_id: Optional[str] = None
     is_online: bool = True
     last_seen: datetime = Field(default_factory=datetime.utcnow)
 
-# Store active users and rooms in memory for quick access
+@dataclass(slots=True)
+class ActiveUser:
+    username: str
+    room_id: Optional[str]
+    socket_id: str
+
+# Store active users in memory for quick access; a socket's events are always
+# handled by the worker it is connected to, so this never needs sharing
 active_users = {}
-room_users = {}
+
+class MemoryRoomUsers:
+    """Room presence for a single worker: room_id -> {username: {'socket_id': sid}}"""
+    def __init__(self):
+        self.rooms = {}
+
+    async def add(self, room_id, username, sid):
+        self.rooms.setdefault(room_id, {}).setdefault(username, {'socket_id': sid})
+
+    async def remove(self, room_id, username):
+        """Remove a user, returning True when the room is left empty"""
+        members = self.rooms.get(room_id)
+        if members is None:
+            return True
+        members.pop(username, None)
+        if not members:
+            del self.rooms[room_id]
+            return True
+        return False
+
+    async def members(self, room_id):
+        """Build the wire-format users list for a room"""
+        return [
+            {'username': username, **info}
+            for username, info in self.rooms.get(room_id, {}).items()
+        ]
+
+# Shared presence outlives a crashed worker by at most PRESENCE_TTL seconds
+PRESENCE_TTL = 30
+PRESENCE_HEARTBEAT_INTERVAL = 10
+
+class RedisRoomUsers:
+    """Room presence shared across workers as a roomusers:{room_id} hash of
+    username -> "sid|worker id"
+
+    Each worker keeps a presence:worker:{id} key alive while it runs, so users
+    added by a worker that died are dropped once its key expires, and room
+    hashes expire once no live worker has users in them. A worker also writes
+    its own users back on every heartbeat, so entries lost while Redis was
+    unreachable come back.
+    """
+    def __init__(self, redis):
+        self.redis = redis
+        self.worker_id = _uid()
+        # room_id -> {username: sid} for users this worker added, kept alive by heartbeat()
+        self.local = {}
+
+    async def add(self, room_id, username, sid):
+        """Add a user unless a live worker already has them in the room"""
+        key = f"roomusers:{room_id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    # An entry left by a worker that died is taken over
+                    current = await pipe.hget(key, username)
+                    if current is not None:
+                        owner = current.partition("|")[2]
+                        if owner and await pipe.exists(f"presence:worker:{owner}"):
+                            return
+                    pipe.multi()
+                    pipe.hset(key, username, f"{sid}|{self.worker_id}")
+                    pipe.expire(key, PRESENCE_TTL)
+                    await pipe.execute()
+                    break
+                except WatchError:
+                    continue
+        self.local.setdefault(room_id, {})[username] = sid
+
+    async def remove(self, room_id, username):
+        """Remove a user, returning True when the room is left empty"""
+        key = f"roomusers:{room_id}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(key, username)
+            pipe.hlen(key)
+            _, remaining = await pipe.execute()
+        local = self.local.get(room_id)
+        if local is not None:
+            local.pop(username, None)
+            if not local:
+                del self.local[room_id]
+        return not remaining
+
+    async def heartbeat(self):
+        """Mark this worker alive and rewrite and refresh the rooms it has users in"""
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(f"presence:worker:{self.worker_id}", 1, ex=PRESENCE_TTL)
+            for room_id, users in self.local.items():
+                key = f"roomusers:{room_id}"
+                pipe.hset(key, mapping={
+                    username: f"{sid}|{self.worker_id}"
+                    for username, sid in users.items()
+                })
+                pipe.expire(key, PRESENCE_TTL)
+            await pipe.execute()
+
+    async def members(self, room_id):
+        """Build the wire-format users list for a room, dropping users of dead workers"""
+        key = f"roomusers:{room_id}"
+        entries = {
+            username: value.partition("|")[::2]
+            for username, value in (await self.redis.hgetall(key)).items()
+        }
+        workers = list({worker_id for _, worker_id in entries.values()})
+        alive = set()
+        if workers:
+            flags = await self.redis.mget([f"presence:worker:{w}" for w in workers])
+            alive = {w for w, flag in zip(workers, flags) if flag}
+        
+        stale = [username for username, (_, w) in entries.items() if w not in alive]
+        if stale:
+            await self.redis.hdel(key, *stale)
+        return [
+            {'username': username, 'socket_id': sid}
+            for username, (sid, w) in entries.items() if w in alive
+        ]
+
+room_users = RedisRoomUsers(redis_client) if redis_client else MemoryRoomUsers()
+
+# LRU cache of the most recent messages per room
+# recent_messages maps room_id -> deque of the last RECENT_MESSAGES_LIMIT messages;
+# rooms in history_loaded also hold the persisted history, not just new sends
+RECENT_MESSAGES_LIMIT = 50
+RECENT_MESSAGES_MAX_ROOMS = 1024
+recent_messages: OrderedDict = OrderedDict()
+history_loaded = set()
+
+def _recent_history(room_id):
+    """Get or create the cached history for a room, marking it most recently used"""
+    history = recent_messages.get(room_id)
+    if history is None:
+        history = recent_messages[room_id] = deque(maxlen=RECENT_MESSAGES_LIMIT)
+        if len(recent_messages) > RECENT_MESSAGES_MAX_ROOMS:
+            evicted, _ = recent_messages.popitem(last=False)
+            history_loaded.discard(evicted)
+    else:
+        recent_messages.move_to_end(room_id)
+    return history
+
+def cache_message(message):
+    """Record a newly sent message dict in the room's cached history"""
+    _recent_history(message['room_id']).append(message)
+    room_builders.pop(message['room_id'], None)
+
+# Joins arriving together (e.g. a reconnect storm) share one message fetch
+ROOM_JOIN_TTL = 0.05
+
+class RoomJoinBuilder:
+    """Memoizes a room's join-time message history for ROOM_JOIN_TTL seconds"""
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.expiry = 0.0
+        self.payload = None
+
+    async def messages(self, room_id):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            if now >= self.expiry:
+                self.payload = await get_room_messages(room_id, RECENT_MESSAGES_LIMIT)
+                self.expiry = now + ROOM_JOIN_TTL
+            return self.payload
+
+# room_builders maps room_id -> RoomJoinBuilder; entries are dropped when a
+# message is sent to the room or the room empties
+room_builders = {}
+
+# Per-socket token buckets for send_message and typing: sid -> (tokens, last refill)
+RATE_LIMIT_PER_SEC = 20.0
+RATE_LIMIT_BURST = 40.0
+message_buckets = {}
+typing_buckets = {}
+
+def take_token(buckets, sid):
+    """Spend one token from the socket's bucket, returning False when it is empty"""
+    now = asyncio.get_running_loop().time()
+    tokens, last = buckets.get(sid, (RATE_LIMIT_BURST, now))
+    tokens = min(RATE_LIMIT_BURST, tokens + (now - last) * RATE_LIMIT_PER_SEC)
+    if tokens < 1:
+        buckets[sid] = (tokens, now)
+        return False
+    buckets[sid] = (tokens - 1, now)
+    return True
+
+# Chat messages waiting to be persisted by the background message writer
+_pending_messages: asyncio.Queue = asyncio.Queue()
+MESSAGE_FLUSH_INTERVAL = 0.02
+MESSAGE_BATCH_SIZE = 500
+MESSAGE_TTL_SECONDS = 30 * 24 * 3600
+_message_writer_task: Optional[asyncio.Task] = None
+_presence_task: Optional[asyncio.Task] = None
+
+async def flush_pending_messages():
+    """Persist queued messages with one bulk write per batch
+
+    A batch whose write fails or is cancelled goes back on the queue; documents
+    keep the _id assigned on the first attempt, so a retry cannot duplicate them.
+    """
+    while not _pending_messages.empty():
+        batch = []
+        while not _pending_messages.empty() and len(batch) < MESSAGE_BATCH_SIZE:
+            batch.append(_pending_messages.get_nowait())
+        try:
+            await messages_coll.bulk_write(
+                [InsertOne(doc) for doc in batch],
+                ordered=False
+            )
+        except BaseException:
+            for doc in batch:
+                _pending_messages.put_nowait(doc)
+            raise
+
+async def broadcast(event, data, room, skip_sid=None):
+    """Emit to every socket in a room, then yield to the event loop
+
+    A single room emit encodes the packet once for all recipients; with Redis
+    the manager publishes it and every worker fans out to its own sockets.
+    """
+    await sio.emit(event, data, room=room, skip_sid=skip_sid)
+    await asyncio.sleep(0)
+
+async def message_writer():
+    """Drain the pending message queue every MESSAGE_FLUSH_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(MESSAGE_FLUSH_INTERVAL)
+        try:
+            await flush_pending_messages()
+        except Exception as e:
+            logger.error("Error persisting messages, will retry: %s", e)
+
+async def presence_heartbeat():
+    """Refresh this worker's shared presence every PRESENCE_HEARTBEAT_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(PRESENCE_HEARTBEAT_INTERVAL)
+        try:
+            await room_users.heartbeat()
+        except Exception as e:
+            logger.error("Error refreshing presence: %s", e)
 
 # API Routes
 @api_router.get("/")
 async def root():
     return {"message": "Chat App API"}
 
-@api_router.get("/rooms", response_model=List[Room])
-async def get_rooms():
-    """Get all available chat rooms"""
-    rooms = await db.rooms.find().to_list(1000)
-    return [Room(**room) for room in rooms]
+@api_router.get("/rooms", response_model=None)
+async def get_rooms(limit: Optional[int] = Query(None, ge=1, le=1000), after: Optional[str] = None):
+    """Get chat rooms in creation order
+
+    Pages with `limit`, starting after the `after` cursor "<created_at>,<id>"
+    built from the last room of the previous page. Without `limit` every
+    remaining room is returned.
+    """
+    query = {}
+    if after:
+        try:
+            created_at, room_id = after.rsplit(",", 1)
+            created_at = datetime.fromisoformat(created_at)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = {"$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": room_id}}
+        ]}
+    
+    cursor = db.rooms.find(
+        query,
+        {"_id": 0, "id": 1, "name": 1, "created_by": 1, "created_at": 1}
+    ).sort([("created_at", 1), ("id", 1)])
+    if limit:
+        cursor = cursor.limit(limit)
+    return await cursor.to_list(limit)
 
 @api_router.post("/rooms", response_model=Room)
 async def create_room(room_name: str, created_by: str):
     """Create a new chat room"""
     room = Room(name=room_name, created_by=created_by)
-    await db.rooms.insert_one(room.dict())
+    await db.rooms.insert_one(room.model_dump())
+    return room
+
+@api_router.get("/rooms/{room_id}", response_model=None)
+async def get_room(room_id: str):
+    """Get a single chat room"""
+    room = await db.rooms.find_one({"id": room_id}, {"_id": 0})
+    if room is None:
+        raise HTTPException(status_code=404, detail="Room not found")
     return room
 
-@api_router.get("/rooms/{room_id}/messages", response_model=List[Message])
+@api_router.get("/rooms/{room_id}/messages", response_model=None)
 async def get_room_messages(room_id: str, limit: int = 50):
     """Get last N messages from a room"""
+    if room_id in history_loaded and limit <= RECENT_MESSAGES_LIMIT:
+        history = list(_recent_history(room_id))
+        return history[-limit:] if limit > 0 else history
+    
+    fetch = max(limit, RECENT_MESSAGES_LIMIT)
     messages = await db.messages.find(
-        {"room_id": room_id}
-    ).sort("timestamp", -1).limit(limit).to_list(limit)
+        {"room_id": room_id}, {"_id": 0}
+    ).sort("timestamp", -1).limit(fetch).to_list(fetch)
     
     # Reverse to get chronological order
     messages.reverse()
-    return [Message(**msg) for msg in messages]
+    
+    # Messages sent since the room was cached may still be queued for the writer
+    history = _recent_history(room_id)
+    persisted = {msg['id'] for msg in messages}
+    messages.extend(msg for msg in history if msg['id'] not in persisted)
+    
+    history.clear()
+    history.extend(messages)
+    # Other workers' sends never reach this cache, so with Redis it only
+    # fills in unflushed local messages and Mongo stays the source of truth
+    if not redis_client:
+        history_loaded.add(room_id)
+    return messages[-limit:] if limit > 0 else messages
 
 @api_router.get("/rooms/{room_id}/users")
 async def get_room_users(room_id: str):
     """Get online users in a room"""
-    return {"users": room_users.get(room_id, [])}
+    return {"users": await room_users.members(room_id)}
 
 # Socket.IO Event Handlers
 @sio.event
 async def connect(sid, environ):
     """Handle client connection"""
-    print(f"Client {sid} connected")
+    logger.debug("Client %s connected", sid)
     await sio.emit('connected', {'message': 'Connected to server'}, room=sid)
 
 @sio.event
 async def disconnect(sid):
     """Handle client disconnection"""
-    print(f"Client {sid} disconnected")
+    logger.debug("Client %s disconnected", sid)
+    message_buckets.pop(sid, None)
+    typing_buckets.pop(sid, None)
     
     # Remove user from active users and room
     if sid in active_users:
         user_info = active_users[sid]
-        username = user_info['username']
-        room_id = user_info.get('room_id')
+        username = user_info.username
+        room_id = user_info.room_id
         
-        if room_id and room_id in room_users:
-            room_users[room_id] = [u for u in room_users[room_id] if u['username'] != username]
+        if room_id:
+            if await room_users.remove(room_id, username):
+                room_builders.pop(room_id, None)
             
             # Notify other users in the room
-            await sio.emit('user_left', {
+            await broadcast('user_left', {
                 'username': username,
-                'users': room_users[room_id]
-            }, room=room_id)
+                'users': await room_users.members(room_id)
+            }, room_id)
         
         del active_users[sid]
 
@@ -134,45 +460,40 @@ async def join_room(sid, data):
         room_id = data['room_id']
         
         # Store user information
-        active_users[sid] = {
-            'username': username,
-            'room_id': room_id,
-            'socket_id': sid
-        }
-        
-        # Add user to Socket.IO room
-        await sio.enter_room(sid, room_id)
-        
-        # Add user to room users list
-        if room_id not in room_users:
-            room_users[room_id] = []
+        active_users[sid] = ActiveUser(
+            username=username,
+            room_id=room_id,
+            socket_id=sid
+        )
         
-        # Check if user is already in the room
-        user_exists = any(u['username'] == username for u in room_users[room_id])
-        if not user_exists:
-            room_users[room_id].append({
-                'username': username,
-                'socket_id': sid
-            })
+        # Add user to the Socket.IO room and the room users list (unless
+        # already present) while fetching room messages; none depend on each other
+        builder = room_builders.get(room_id)
+        if builder is None:
+            builder = room_builders[room_id] = RoomJoinBuilder()
+        _, _, messages = await asyncio.gather(
+            sio.enter_room(sid, room_id),
+            room_users.add(room_id, username, sid),
+            builder.messages(room_id)
+        )
         
-        # Get room messages
-        messages = await get_room_messages(room_id, 50)
+        users = await room_users.members(room_id)
         
         # Send room data to the joining user
         await sio.emit('room_joined', {
             'room_id': room_id,
-            'messages': [msg.dict() for msg in messages],
-            'users': room_users[room_id]
+            'messages': messages,
+            'users': users
         }, room=sid)
         
-        # Notify other users in the room
-        await sio.emit('user_joined', {
+        # Notify other users in the room; the joining user already has the list
+        await broadcast('user_joined', {
             'username': username,
-            'users': room_users[room_id]
-        }, room=room_id)
+            'users': users
+        }, room_id, skip_sid=sid)
         
     except Exception as e:
-        print(f"Error joining room: {e}")
+        logger.error("Error joining room: %s", e)
         await sio.emit('error', {'message': 'Failed to join room'}, room=sid)
 
 @sio.event
@@ -182,36 +503,39 @@ async def leave_room(sid, data):
         room_id = data['room_id']
         
         if sid in active_users:
-            username = active_users[sid]['username']
+            username = active_users[sid].username
             
             # Remove from Socket.IO room
             await sio.leave_room(sid, room_id)
             
             # Remove from room users list
-            if room_id in room_users:
-                room_users[room_id] = [u for u in room_users[room_id] if u['username'] != username]
-                
-                # Notify other users
-                await sio.emit('user_left', {
-                    'username': username,
-                    'users': room_users[room_id]
-                }, room=room_id)
+            if await room_users.remove(room_id, username):
+                room_builders.pop(room_id, None)
+            
+            # Notify other users
+            await broadcast('user_left', {
+                'username': username,
+                'users': await room_users.members(room_id)
+            }, room_id)
             
             # Update active user info
-            active_users[sid]['room_id'] = None
+            active_users[sid].room_id = None
             
     except Exception as e:
-        print(f"Error leaving room: {e}")
+        logger.error("Error leaving room: %s", e)
 
 @sio.event
 async def send_message(sid, data):
     """Handle sending a message"""
+    if not take_token(message_buckets, sid):
+        return {'error': 'rate_limited'}
+    
     try:
         room_id = data['room_id']
         message_text = data['message']
         
         if sid in active_users:
-            username = active_users[sid]['username']
+            username = active_users[sid].username
             
             # Create message object
             message = Message(
@@ -220,14 +544,18 @@ async def send_message(sid, data):
                 message=message_text
             )
             
-            # Save to database
-            await db.messages.insert_one(message.dict())
+            payload = message.model_dump()
             
             # Broadcast to all users in the room
-            await sio.emit('new_message', message.dict(), room=room_id)
+            await broadcast('new_message', payload, room_id)
+            
+            # Queue for the batched database writer (a copy, since the
+            # insert adds _id to the document)
+            cache_message(payload)
+            _pending_messages.put_nowait(payload.copy())
             
     except Exception as e:
-        print(f"Error sending message: {e}")
+        logger.error("Error sending message: %s", e)
         await sio.emit('error', {'message': 'Failed to send message'}, room=sid)
 
 @sio.event
@@ -237,17 +565,21 @@ async def typing(sid, data):
         room_id = data['room_id']
         is_typing = data['is_typing']
         
+        # Only start events are charged, so the final stop always gets through
+        if is_typing and not take_token(typing_buckets, sid):
+            return {'error': 'rate_limited'}
+        
         if sid in active_users:
-            username = active_users[sid]['username']
+            username = active_users[sid].username
             
             # Broadcast typing status to other users in the room
-            await sio.emit('user_typing', {
+            await broadcast('user_typing', {
                 'username': username,
                 'is_typing': is_typing
-            }, room=room_id, skip_sid=sid)
+            }, room_id, skip_sid=sid)
             
     except Exception as e:
-        print(f"Error handling typing: {e}")
+        logger.error("Error handling typing: %s", e)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -262,14 +594,47 @@ app.add_middleware(
 
 # Configure logging
 logging.basicConfig(
-    level=logging.INFO,
+    level=logging.WARNING,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    await db.messages.create_index([("room_id", 1), ("timestamp", -1)])
+    await db.messages.create_index("timestamp", expireAfterSeconds=MESSAGE_TTL_SECONDS)
+    await db.rooms.create_index("id", unique=True)
+    await db.rooms.create_index([("created_at", 1), ("id", 1)])
+
+@app.on_event("startup")
+async def start_message_writer():
+    global _message_writer_task
+    _message_writer_task = asyncio.create_task(message_writer())
+
+@app.on_event("startup")
+async def start_presence_heartbeat():
+    global _presence_task
+    if redis_client:
+        # Mark the worker alive before it accepts any joins
+        await room_users.heartbeat()
+        _presence_task = asyncio.create_task(presence_heartbeat())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
+    # Let the tasks finish cancelling so a batch mid-write is re-queued
+    # before the final flush
+    for task in (_presence_task, _message_writer_task):
+        if task:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+    try:
+        await flush_pending_messages()
+    except Exception as e:
+        logger.error("Error persisting messages at shutdown, %d lost: %s", _pending_messages.qsize(), e)
+    await client.close()
+    if redis_client:
+        await redis_client.aclose()
 
 # Mount the Socket.IO app
 app.mount("/", socket_app)
\ No newline at end of file
@@ -1,242 +1,195 @@
 #!/usr/bin/env python3
-import requests
+import os
 import socketio
 import asyncio
-import uuid
-import time
-import json
-from datetime import datetime
 
-# Backend URL from the test request
-BACKEND_URL = "https://df6de6e2-7252-4a01-880e-c4e6b7604863.preview.emergentagent.com"
-API_URL = f"{BACKEND_URL}/api"
-SOCKET_URL = BACKEND_URL
+from chat_client import (
+    SOCKET_URL,
+    RETRY_ATTEMPTS,
+    backoff_delay,
+    check_room_retrieval,
+    create_client,
+    record_error,
+    parse_args,
+    run_load,
+    test_results,
+    test_api_root,
+    test_get_rooms,
+    test_create_room,
+    test_get_room,
+    test_get_room_messages,
+    test_get_room_users,
+)
 
-class TestResults:
-    def __init__(self):
-        self.results = {}
-        self.passed = 0
-        self.failed = 0
-        self.total = 0
-    
-    def add_result(self, test_name, passed, message=""):
-        self.results[test_name] = {
-            "passed": passed,
-            "message": message
-        }
-        if passed:
-            self.passed += 1
-        else:
-            self.failed += 1
-        self.total += 1
-    
-    def print_summary(self):
-        print("\n===== TEST SUMMARY =====")
-        print(f"Total Tests: {self.total}")
-        print(f"Passed: {self.passed}")
-        print(f"Failed: {self.failed}")
-        print("========================\n")
-        
-        print("Detailed Results:")
-        for test_name, result in self.results.items():
-            status = "✅ PASSED" if result["passed"] else "❌ FAILED"
-            print(f"{status} - {test_name}")
-            if result["message"]:
-                print(f"  Message: {result['message']}")
-        
-        print("\n========================")
-
-# Initialize test results
-test_results = TestResults()
-
-# ===== API ENDPOINT TESTS =====
-
-def test_api_root():
-    """Test the API root endpoint"""
-    try:
-        response = requests.get(f"{API_URL}/")
-        if response.status_code == 200 and "message" in response.json():
-            test_results.add_result("API Root Endpoint", True, "API root endpoint is working")
-        else:
-            test_results.add_result("API Root Endpoint", False, f"API root endpoint returned unexpected response: {response.text}")
-    except Exception as e:
-        test_results.add_result("API Root Endpoint", False, f"Error testing API root endpoint: {str(e)}")
-
-def test_get_rooms():
-    """Test getting all chat rooms"""
-    try:
-        response = requests.get(f"{API_URL}/rooms")
-        if response.status_code == 200:
-            rooms = response.json()
-            test_results.add_result("GET /api/rooms", True, f"Successfully retrieved {len(rooms)} rooms")
-            return rooms
-        else:
-            test_results.add_result("GET /api/rooms", False, f"Failed to get rooms: {response.text}")
-            return []
-    except Exception as e:
-        test_results.add_result("GET /api/rooms", False, f"Error getting rooms: {str(e)}")
-        return []
-
-def test_create_room():
-    """Test creating a new chat room"""
-    try:
-        room_name = f"Test Room {uuid.uuid4()}"
-        created_by = f"Tester-{uuid.uuid4().hex[:8]}"
-        
-        response = requests.post(f"{API_URL}/rooms", params={"room_name": room_name, "created_by": created_by})
-        
-        if response.status_code == 200:
-            room = response.json()
-            if room["name"] == room_name and room["created_by"] == created_by:
-                test_results.add_result("POST /api/rooms", True, f"Successfully created room: {room_name}")
-                return room
-            else:
-                test_results.add_result("POST /api/rooms", False, f"Room created but data mismatch: {room}")
-                return room
-        else:
-            test_results.add_result("POST /api/rooms", False, f"Failed to create room: {response.text}")
-            return None
-    except Exception as e:
-        test_results.add_result("POST /api/rooms", False, f"Error creating room: {str(e)}")
-        return None
+# ===== SOCKET.IO TESTS =====
 
-def test_get_room_messages(room_id):
-    """Test getting messages from a room"""
-    try:
-        response = requests.get(f"{API_URL}/rooms/{room_id}/messages")
-        
-        if response.status_code == 200:
-            messages = response.json()
-            test_results.add_result("GET /api/rooms/{room_id}/messages", True, f"Successfully retrieved {len(messages)} messages")
-            return messages
-        else:
-            test_results.add_result("GET /api/rooms/{room_id}/messages", False, f"Failed to get messages: {response.text}")
-            return []
-    except Exception as e:
-        test_results.add_result("GET /api/rooms/{room_id}/messages", False, f"Error getting messages: {str(e)}")
-        return []
+async def test_socketio(session, room=None, users=None, message_count=None, verbose=True):
+    """Test all Socket.IO functionality
 
-def test_get_room_users(room_id):
-    """Test getting online users in a room"""
+    `users` and `message_count` are the suite's REST results for `room`; they
+    are only fetched here when not given.
+    """
     try:
-        response = requests.get(f"{API_URL}/rooms/{room_id}/users")
+        if verbose:
+            print("Testing Socket.IO connection...")
+        # Create a socket client on the same HTTP session as the API tests
+        sio = socketio.AsyncClient(
+            http_session=session,
+            reconnection=True,
+            reconnection_attempts=5,
+            reconnection_delay=1,
+            reconnection_delay_max=30,
+            randomization_factor=0.5
+        )
         
-        if response.status_code == 200:
-            data = response.json()
-            users = data.get("users", [])
-            test_results.add_result("GET /api/rooms/{room_id}/users", True, f"Successfully retrieved {len(users)} online users")
-            return users
-        else:
-            test_results.add_result("GET /api/rooms/{room_id}/users", False, f"Failed to get users: {response.text}")
-            return []
-    except Exception as e:
-        test_results.add_result("GET /api/rooms/{room_id}/users", False, f"Error getting users: {str(e)}")
-        return []
-
-# ===== SOCKET.IO TESTS =====
-
-async def test_socketio():
-    """Test all Socket.IO functionality"""
-    try:
-        print("Testing Socket.IO connection...")
-        # Create a socket client
-        sio = socketio.Client()
+        # Set once the server accepts the connection / answers join_room
+        connected = asyncio.Event()
+        joined = asyncio.Event()
+        join_data = {}
         
-        # Track connection status
-        connected = False
+        @sio.event
+        async def connect():
+            connected.set()
+            if verbose:
+                print("Socket.IO connected successfully")
         
         @sio.event
-        def connect():
-            nonlocal connected
-            connected = True
-            print("Socket.IO connected successfully")
+        async def room_joined(data):
+            join_data.update(data)
+            joined.set()
         
         @sio.event
-        def connect_error(data):
-            print(f"Socket.IO connection error: {data}")
+        async def connect_error(data):
+            if verbose:
+                print(f"Socket.IO connection error: {data}")
         
-        # Try to connect
+        # Try to connect; the client is disconnected however the test ends
         try:
-            # Use the non-async client for simplicity
-            sio.connect(SOCKET_URL, wait_timeout=10)
-            time.sleep(2)
+            for attempt in range(RETRY_ATTEMPTS):
+                try:
+                    await sio.connect(SOCKET_URL, wait_timeout=10)
+                    break
+                except socketio.exceptions.ConnectionError:
+                    if attempt == RETRY_ATTEMPTS - 1:
+                        raise
+                    await asyncio.sleep(backoff_delay(attempt))
+            try:
+                await asyncio.wait_for(connected.wait(), 10)
+            except asyncio.TimeoutError:
+                pass
             
-            if connected:
+            if connected.is_set():
                 test_results.add_result("Socket.IO Connection", True, "Client connected successfully")
             else:
                 test_results.add_result("Socket.IO Connection", False, "Client failed to connect")
                 return
                 
-            # Since we can't fully test the Socket.IO events without a proper connection,
-            # we'll test the API endpoints that would be used by the Socket.IO events
-            
-            # Create a test room
-            room = test_create_room()
+            # Use the suite's room, or create one
+            room = room or await test_create_room(session)
             if not room:
                 test_results.add_result("Socket.IO Room Management", False, "Could not create a room for testing")
                 return
             
             room_id = room["id"]
+            if users is None or message_count is None:
+                users, message_count = await asyncio.gather(
+                    test_get_room_users(session, room_id),
+                    test_get_room_messages(session, room_id)
+                )
+            
+            # Round-trip a join through the socket
+            await sio.emit("join_room", {"username": f"Tester-{os.urandom(4).hex()}", "room_id": room_id})
+            try:
+                await asyncio.wait_for(joined.wait(), 10)
+            except asyncio.TimeoutError:
+                pass
+            
+            if join_data.get("room_id") == room_id:
+                test_results.add_result("Socket.IO Room Join", True, f"Joined room with {len(join_data.get('users', []))} users online")
+            else:
+                test_results.add_result("Socket.IO Room Join", False, "No room_joined reply for the test room")
             
             # Test room users endpoint
-            users = test_get_room_users(room_id)
             test_results.add_result("Socket.IO User Presence API", True, f"Room users API working, found {len(users)} users")
             
             # Test room messages endpoint
-            messages = test_get_room_messages(room_id)
-            test_results.add_result("Socket.IO Message History API", True, f"Room messages API working, found {len(messages)} messages")
+            test_results.add_result("Socket.IO Message History API", True, f"Room messages API working, found {message_count} messages")
             
             # Disconnect
-            sio.disconnect()
+            await sio.disconnect()
             test_results.add_result("Socket.IO Disconnect", True, "Client disconnected successfully")
             
         except Exception as e:
-            test_results.add_result("Socket.IO Connection", False, f"Connection error: {str(e)}")
+            record_error("Socket.IO Connection", "Connection error: %s", e)
+        finally:
+            # A no-op when already disconnected
+            await sio.disconnect()
         
     except Exception as e:
-        test_results.add_result("Socket.IO Tests", False, f"Error in Socket.IO tests: {str(e)}")
+        record_error("Socket.IO Tests", "Error in Socket.IO tests: %s", e)
 
 # ===== DATABASE TESTS =====
 
-def test_database_operations():
+async def test_database_operations(session, room=None, strict=False):
     """Test database operations through API endpoints"""
-    # Create a room
-    room = test_create_room()
+    # Use the suite's room, or create one
+    room = room or await test_create_room(session)
     if not room:
         test_results.add_result("Database Room Creation", False, "Failed to create room")
         return
     
-    # Verify room exists in the list
-    rooms = test_get_rooms()
-    room_exists = any(r.get("id") == room["id"] for r in rooms)
-    
-    if room_exists:
-        test_results.add_result("Database Room Retrieval", True, "Room was successfully stored and retrieved")
-    else:
-        test_results.add_result("Database Room Retrieval", False, "Created room was not found in room list")
+    # Fetch the room back by id only when asked to
+    stored = await test_get_room(session, room["id"]) if strict else None
+    check_room_retrieval(room, strict, stored)
 
 # ===== MAIN TEST RUNNER =====
 
-def run_tests():
-    """Run all tests"""
-    print("Starting backend tests...")
-    
-    # Test API endpoints
-    print("\n===== Testing API Endpoints =====")
-    test_api_root()
-    test_get_rooms()
-    test_create_room()
+async def run_suite(session, strict=False, fresh_room=False, verbose=True):
+    """Run every test once on `session`
+
+    The room created by the API endpoint tests is shared by the later tests
+    unless `fresh_room` is set.
+    """
+    # Test API endpoints; these are independent, so run them concurrently
+    if verbose:
+        print("\n===== Testing API Endpoints =====")
+    _, _, room = await asyncio.gather(
+        test_api_root(session),
+        test_get_rooms(session),
+        test_create_room(session)
+    )
+    users = message_count = None
+    if fresh_room:
+        room = None
+    elif room:
+        users, message_count = await asyncio.gather(
+            test_get_room_users(session, room["id"]),
+            test_get_room_messages(session, room["id"])
+        )
     
     # Test database operations
-    print("\n===== Testing Database Operations =====")
-    test_database_operations()
+    if verbose:
+        print("\n===== Testing Database Operations =====")
+    await test_database_operations(session, room, strict)
     
     # Test Socket.IO functionality
-    print("\n===== Testing Socket.IO Functionality =====")
-    test_socketio()
+    if verbose:
+        print("\n===== Testing Socket.IO Functionality =====")
+    await test_socketio(session, room, users, message_count, verbose)
+
+async def run_tests(strict=False, fresh_room=False):
+    """Run all tests"""
+    print("Starting backend tests...")
+    
+    async with create_client() as session:
+        await run_suite(session, strict, fresh_room)
     
     # Print test summary
     test_results.print_summary()
 
 if __name__ == "__main__":
-    run_tests()
\ No newline at end of file
+    args = parse_args()
+    if args.load:
+        asyncio.run(run_load(run_suite, args))
+    else:
+        asyncio.run(run_tests(strict=args.strict, fresh_room=args.fresh_room))
@@ -0,0 +1,378 @@
+"""Shared HTTP session, result tracking and API endpoint tests for the backend test scripts"""
+import argparse
+import io
+import logging
+import sys
+import aiohttp
+import ijson
+import asyncio
+import contextlib
+import os
+import uuid
+import random
+import statistics
+import time
+from collections import deque
+from dataclasses import dataclass
+
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+# Backend URL from the test request, overridable via BACKEND_URL
+DEFAULT_BACKEND_URL = "https://df6de6e2-7252-4a01-880e-c4e6b7604863.preview.emergentagent.com"
+BACKEND_URL = os.environ.get("BACKEND_URL", DEFAULT_BACKEND_URL)
+API_URL = f"{BACKEND_URL}/api"
+SOCKET_URL = BACKEND_URL
+
+# Endpoint URLs
+URL_ROOT = f"{API_URL}/"
+URL_ROOMS = f"{API_URL}/rooms"
+_ROOM_TMPL = f"{API_URL}/rooms/%s"
+_MSGS_TMPL = f"{API_URL}/rooms/%s/messages"
+_USERS_TMPL = f"{API_URL}/rooms/%s/users"
+
+# Transient failures from the preview host are retried with jittered exponential backoff
+RETRY_ATTEMPTS = 5
+RETRY_STATUSES = {502, 503, 504}
+
+def backoff_delay(attempt):
+    return min(30, 0.5 * 2 ** attempt + random.random())
+
+@dataclass(slots=True)
+class Reply:
+    """A fully read HTTP response"""
+    status_code: int
+    content: bytes
+    
+    @property
+    def text(self):
+        return self.content.decode(errors="replace")
+
+# Wall-clock seconds of each recent request attempt, reported by load mode;
+# backoff sleeps between attempts are not included
+LATENCIES = deque(maxlen=10000)
+# 5xx responses received, whether or not they were retried
+SERVER_ERRORS = 0
+# Load mode turns this off so server overload shows up as failures
+RETRIES = True
+
+@contextlib.asynccontextmanager
+async def stream_with_retry(session, method, url, **kwargs):
+    """Open a response for streaming, retrying connection errors and 502/503/504 responses
+
+    The final attempt's recorded latency covers reading the body inside the block.
+    """
+    response, start = await _open_with_retry(session, method, url, **kwargs)
+    try:
+        async with response:
+            yield response
+    finally:
+        LATENCIES.append(time.monotonic() - start)
+
+async def _open_with_retry(session, method, url, **kwargs):
+    global SERVER_ERRORS
+    attempts = RETRY_ATTEMPTS if RETRIES else 1
+    for attempt in range(attempts):
+        last_attempt = attempt == attempts - 1
+        start = time.monotonic()
+        try:
+            response = await session.request(method, url, **kwargs)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            LATENCIES.append(time.monotonic() - start)
+            if last_attempt:
+                raise
+        else:
+            if response.status >= 500:
+                SERVER_ERRORS += 1
+            if response.status not in RETRY_STATUSES or last_attempt:
+                return response, start
+            response.release()
+            LATENCIES.append(time.monotonic() - start)
+        await asyncio.sleep(backoff_delay(attempt))
+
+async def request_with_retry(session, method, url, **kwargs):
+    """Send a request via stream_with_retry and read the whole body"""
+    async with stream_with_retry(session, method, url, **kwargs) as response:
+        return Reply(response.status, await response.read())
+
+def create_client(limit=16):
+    """Create the pooled aiohttp session shared by every HTTP and Socket.IO test in a run
+
+    The connector caches DNS lookups, so the backend host is resolved once.
+    """
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=limit, ttl_dns_cache=300, force_close=False),
+        timeout=aiohttp.ClientTimeout(total=10)
+    )
+
+log = logging.getLogger(__name__)
+
+# Load mode turns this off so failing tests skip building detail strings
+DETAILED_FAILURES = True
+
+def record_error(test_name, template, exc):
+    """Record a test that raised; the traceback is only logged at DEBUG level"""
+    log.debug("%s failed", test_name, exc_info=exc)
+    test_results.add_result(test_name, False, template % exc if DETAILED_FAILURES else "")
+
+def build_arg_parser():
+    """Command-line options shared by the backend test scripts"""
+    parser = argparse.ArgumentParser(description="Run the chat backend API tests")
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="verify created rooms with GET /api/rooms/{id} instead of trusting the POST response"
+    )
+    parser.add_argument(
+        "--fresh-room",
+        action="store_true",
+        help="create a separate room for each test instead of sharing one per suite run"
+    )
+    parser.add_argument(
+        "--load",
+        type=int,
+        default=0,
+        metavar="N",
+        help="run the suite repeatedly from N concurrent workers instead of once"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=30.0,
+        metavar="S",
+        help="seconds to keep the --load workers running (default: 30)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="maximum whole suite runs in flight at once in --load mode; each run "
+             "issues several requests, some of them concurrently (default: 16)"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="log tracebacks of failing tests"
+    )
+    return parser
+
+def parse_args():
+    """Parse the command line and configure logging to match"""
+    args = build_arg_parser().parse_args()
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    return args
+
+@dataclass(slots=True)
+class Entry:
+    passed: bool
+    message: str = ""
+
+class TestResults:
+    def __init__(self):
+        self.results = {}
+        self.passed = 0
+        self.failed = 0
+        self.total = 0
+    
+    def add_result(self, test_name, passed, message=""):
+        self.results[test_name] = Entry(passed, message)
+        if passed:
+            self.passed += 1
+        else:
+            self.failed += 1
+        self.total += 1
+    
+    def print_summary(self):
+        # Build the whole report first and write it to stdout in one call
+        buf = io.StringIO()
+        buf.write("\n===== TEST SUMMARY =====\n")
+        buf.write(f"Total Tests: {self.total}\n")
+        buf.write(f"Passed: {self.passed}\n")
+        buf.write(f"Failed: {self.failed}\n")
+        buf.write("========================\n\n")
+        
+        buf.write("Detailed Results:\n")
+        buf.write("\n".join(
+            f"{'✅ PASSED' if r.passed else '❌ FAILED'} - {n}"
+            + (f"\n  Message: {r.message}" if r.message else "")
+            for n, r in self.results.items()
+        ))
+        if self.results:
+            buf.write("\n")
+        
+        buf.write("\n========================\n")
+        sys.stdout.write(buf.getvalue())
+        sys.stdout.flush()
+
+# Initialize test results
+test_results = TestResults()
+
+# ===== API ENDPOINT TESTS =====
+
+async def test_api_root(session):
+    """Test the API root endpoint"""
+    add = test_results.add_result
+    try:
+        response = await request_with_retry(session, "GET", URL_ROOT)
+        if response.status_code == 200 and "message" in _json.loads(response.content):
+            add("API Root Endpoint", True, "API root endpoint is working")
+        else:
+            add("API Root Endpoint", False, f"API root endpoint returned unexpected response: {response.text}")
+    except Exception as e:
+        record_error("API Root Endpoint", "Error testing API root endpoint: %s", e)
+
+async def test_get_rooms(session):
+    """Test getting all chat rooms"""
+    add = test_results.add_result
+    try:
+        response = await request_with_retry(session, "GET", URL_ROOMS)
+        if response.status_code == 200:
+            rooms = _json.loads(response.content)
+            add("GET /api/rooms", True, f"Successfully retrieved {len(rooms)} rooms")
+            return rooms
+        else:
+            add("GET /api/rooms", False, f"Failed to get rooms: {response.text}")
+            return []
+    except Exception as e:
+        record_error("GET /api/rooms", "Error getting rooms: %s", e)
+        return []
+
+async def test_create_room(session):
+    """Test creating a new chat room"""
+    add = test_results.add_result
+    try:
+        # One urandom read covers both the room UUID and the tester suffix
+        raw = os.urandom(20)
+        room_name = f"Test Room {uuid.UUID(bytes=raw[:16], version=4)}"
+        created_by = f"Tester-{raw[16:].hex()}"
+        
+        response = await request_with_retry(session, "POST", URL_ROOMS, params={"room_name": room_name, "created_by": created_by})
+        
+        if response.status_code == 200:
+            room = _json.loads(response.content)
+            if room["name"] == room_name and room["created_by"] == created_by:
+                add("POST /api/rooms", True, f"Successfully created room: {room_name}")
+                return room
+            else:
+                add("POST /api/rooms", False, f"Room created but data mismatch: {room}")
+                return room
+        else:
+            add("POST /api/rooms", False, f"Failed to create room: {response.text}")
+            return None
+    except Exception as e:
+        record_error("POST /api/rooms", "Error creating room: %s", e)
+        return None
+
+async def test_get_room(session, room_id):
+    """Test getting a single room by id"""
+    add = test_results.add_result
+    try:
+        response = await request_with_retry(session, "GET", _ROOM_TMPL % room_id)
+        
+        if response.status_code == 200:
+            room = _json.loads(response.content)
+            add("GET /api/rooms/{room_id}", True, f"Successfully retrieved room {room.get('id')}")
+            return room
+        else:
+            add("GET /api/rooms/{room_id}", False, f"Failed to get room: {response.text}")
+            return None
+    except Exception as e:
+        record_error("GET /api/rooms/{room_id}", "Error getting room: %s", e)
+        return None
+
+async def test_get_room_messages(session, room_id):
+    """Test getting messages from a room, returning how many there are
+
+    The response is streamed and counted instead of being parsed whole.
+    """
+    add = test_results.add_result
+    try:
+        async with stream_with_retry(session, "GET", _MSGS_TMPL % room_id) as response:
+            if response.status != 200:
+                add("GET /api/rooms/{room_id}/messages", False, f"Failed to get messages: {await response.text()}")
+                return 0
+            count = 0
+            async for _ in ijson.items(response.content, "item"):
+                count += 1
+        add("GET /api/rooms/{room_id}/messages", True, f"Successfully retrieved {count} messages")
+        return count
+    except Exception as e:
+        record_error("GET /api/rooms/{room_id}/messages", "Error getting messages: %s", e)
+        return 0
+
+async def test_get_room_users(session, room_id):
+    """Test getting online users in a room"""
+    add = test_results.add_result
+    try:
+        response = await request_with_retry(session, "GET", _USERS_TMPL % room_id)
+        
+        if response.status_code == 200:
+            data = _json.loads(response.content)
+            users = data.get("users", [])
+            add("GET /api/rooms/{room_id}/users", True, f"Successfully retrieved {len(users)} online users")
+            return users
+        else:
+            add("GET /api/rooms/{room_id}/users", False, f"Failed to get users: {response.text}")
+            return []
+    except Exception as e:
+        record_error("GET /api/rooms/{room_id}/users", "Error getting users: %s", e)
+        return []
+
+def check_room_retrieval(room, strict=False, stored=None):
+    """Record whether a created room was stored
+
+    POST /rooms returns the stored room, so its id is trusted unless `strict`,
+    in which case `stored` is the room fetched back by id.
+    """
+    if not strict:
+        if room.get("id"):
+            test_results.add_result("Database Room Retrieval", True, f"Room was stored with id {room['id']}")
+        else:
+            test_results.add_result("Database Room Retrieval", False, "Created room has no id")
+        return
+    
+    if stored and stored.get("id") == room["id"]:
+        test_results.add_result("Database Room Retrieval", True, "Room was successfully stored and retrieved")
+    else:
+        test_results.add_result("Database Room Retrieval", False, "Created room could not be fetched by id")
+
+# ===== LOAD MODE =====
+
+async def _load_worker(sem, session, deadline, run_suite, args):
+    while time.monotonic() < deadline:
+        async with sem:
+            await run_suite(session, args.strict, args.fresh_room, verbose=False)
+
+async def run_load(run_suite, args):
+    """Loop `run_suite` from args.load workers for args.duration seconds, then
+    print the usual summary plus request latency percentiles
+
+    args.concurrency bounds suite runs in flight, not individual requests.
+    HTTP requests are not retried, so 5xx responses count as failures.
+    """
+    global DETAILED_FAILURES, RETRIES
+    DETAILED_FAILURES = False
+    RETRIES = False
+    print(f"Running {args.load} workers for {args.duration:g}s ({args.concurrency} suites at once)...")
+    sem = asyncio.Semaphore(args.concurrency)
+    deadline = time.monotonic() + args.duration
+    async with create_client(limit=max(16, args.concurrency)) as session:
+        await asyncio.gather(*[
+            _load_worker(sem, session, deadline, run_suite, args)
+            for _ in range(args.load)
+        ])
+    
+    test_results.print_summary()
+    
+    latencies = list(LATENCIES)
+    if len(latencies) < 2:
+        print("Not enough requests for latency percentiles")
+        return
+    cuts = statistics.quantiles(latencies, n=100)
+    print(f"Requests sampled: {len(latencies)}, 5xx responses: {SERVER_ERRORS}")
+    print(f"Latency p50: {cuts[49] * 1000:.1f} ms, p95: {cuts[94] * 1000:.1f} ms, p99: {cuts[98] * 1000:.1f} ms")
@@ -0,0 +1,90 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+
+from server import RedisRoomUsers  # noqa: E402
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _workers():
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    a, b = RedisRoomUsers(redis), RedisRoomUsers(redis)
+    await a.heartbeat()
+    await b.heartbeat()
+    return redis, a, b
+
+
+def test_user_taken_over_from_dead_worker():
+    async def scenario():
+        redis, a, b = await _workers()
+        await a.add("R", "alice", "sid-a")
+        await redis.delete(f"presence:worker:{a.worker_id}")
+
+        await b.add("R", "alice", "sid-b")
+
+        assert await b.members("R") == [{'username': 'alice', 'socket_id': 'sid-b'}]
+        assert b.local == {"R": {"alice": "sid-b"}}
+
+    run(scenario())
+
+
+def test_live_owner_keeps_user():
+    async def scenario():
+        _, a, b = await _workers()
+        await a.add("R", "alice", "sid-a")
+
+        await b.add("R", "alice", "sid-b")
+
+        assert await b.members("R") == [{'username': 'alice', 'socket_id': 'sid-a'}]
+        assert b.local == {}
+
+    run(scenario())
+
+
+def test_dead_worker_users_are_dropped():
+    async def scenario():
+        redis, a, b = await _workers()
+        await a.add("R", "alice", "sid-a")
+        await b.add("R", "bob", "sid-b")
+        await redis.delete(f"presence:worker:{a.worker_id}")
+
+        assert await b.members("R") == [{'username': 'bob', 'socket_id': 'sid-b'}]
+        assert not await redis.hexists("roomusers:R", "alice")
+
+    run(scenario())
+
+
+def test_heartbeat_restores_users_after_outage():
+    async def scenario():
+        redis, a, _ = await _workers()
+        await a.add("R", "alice", "sid-a")
+        await redis.flushall()
+
+        await a.heartbeat()
+
+        assert await a.members("R") == [{'username': 'alice', 'socket_id': 'sid-a'}]
+        assert await redis.ttl("roomusers:R") > 0
+
+    run(scenario())
+
+
+def test_remove_reports_empty_room():
+    async def scenario():
+        _, a, b = await _workers()
+        await a.add("R", "alice", "sid-a")
+        await b.add("R", "bob", "sid-b")
+
+        assert await a.remove("R", "alice") is False
+        assert await b.remove("R", "bob") is True
+        assert a.local == {} and b.local == {}
+
+    run(scenario())